@@ -1,78 +1,289 @@
+import hashlib
+import io
 import pathlib
 import sys
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import PIL.Image
-from typing import List, Union
+from typing import Dict, Final, Iterator, List, Optional, Tuple, Union
 from google import genai
 
-def analyze_student_attention(images: List[Union[str, PIL.Image.Image]], api_key: str, custom_prompt: str = None) -> str:
-    """
-    Analyzes multiple student webcam images to assess attention levels.
-    
-    Args:
-        images: List of either image paths (str) or PIL Image objects
-        api_key: Gemini API key
-        custom_prompt: Optional custom prompt for final analysis
-    
-    Returns:
-        str: Analysis response from Gemini in a structured format
-    """
-    client = genai.Client(api_key=api_key)
-    
-    # If custom prompt is provided, use it for final analysis
-    if custom_prompt:
-        response = client.models.generate_content(
-            model="gemini-2.0-flash-exp",
-            contents=[custom_prompt]
-        )
-        return response.text
-    
-    # Convert any string paths to PIL Images
-    processed_images = []
-    for img in images:
-        if isinstance(img, str):
-            processed_images.append(PIL.Image.open(img))
-        else:
-            processed_images.append(img)
-    
-    # Enhanced prompt for analysis
-    contents = [
-        """
+# Reuse one client per API key so successive calls share the same pooled
+# HTTPS connections instead of redoing auth/TLS setup every time.
+_CLIENTS: Dict[str, genai.Client] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+def get_client(api_key: str) -> genai.Client:
+    """Return a cached genai.Client for this api_key (thread-safe)."""
+    client = _CLIENTS.get(api_key)
+    if client is None:
+        with _CLIENTS_LOCK:
+            client = _CLIENTS.get(api_key)
+            if client is None:
+                client = genai.Client(api_key=api_key)
+                _CLIENTS[api_key] = client
+    return client
+
+MODEL_NAME: Final[str] = "gemini-2.0-flash-exp"
+
+# Static analysis instructions, hoisted out of the function so the same text
+# can be registered with Gemini's explicit context cache. One interned str
+# object for the life of the process - never rebuilt per call.
+RUBRIC_TEXT: Final[str] = """
         You are an expert supervisor monitoring student attention in an online class through webcam screenshots.
         Analyze the student's attention levels and behavior in detail. DO not respond with anything but the final analysis.
         Dont be super strict with the scores. Its normal for a student to have few weird expressions and have unusual environments in their background.
         So penalise their scores only on serious cases like using mobile phones or looking away too much etc.
-        
+
         Provide your analysis in the following structured format:
-        
+
         1. ATTENTIVENESS_RATING (1-10): Give an overall rating
-        
+
         2. EYE_CONTACT_SCORE (1-10): Rate how well the student maintains eye contact with the screen
         - Consider: gaze direction, frequency of looking away
-        
+
         3. POSTURE_SCORE (1-10): Evaluate the student's sitting posture
         - Consider: upright position, slouching, distance from screen
-        
+
         4. FOCUS_DURATION: Estimate the percentage of time the student appears focused
-        
+
         5. DETAILED_OBSERVATIONS:
         - List specific behaviors observed
         - Note any distractions
         - Describe engagement indicators
-        
+
         Format each metric clearly with "METRIC: score" on its own line for easy parsing.
         You will directly return your result only.
         """
-    ]
-    contents.extend(processed_images)
-    
-    # Generate content using the images
-    response = client.models.generate_content(
-        model="gemini-2.0-flash-exp",
-        contents=contents
+
+# Explicit prompt cache for RUBRIC_TEXT: cached prefix tokens are billed at a
+# fraction of normal and skip re-tokenization on every call. Recreated lazily
+# whenever the server-side TTL runs out.
+_PROMPT_CACHE = None
+_PROMPT_CACHE_EXPIRY = 0.0
+_PROMPT_CACHE_LOCK = threading.Lock()
+_PROMPT_CACHE_TTL_SECONDS = 3600
+
+def _get_prompt_cache(client: genai.Client):
+    """Return the cached-content handle for the rubric, creating or refreshing
+    it as needed. Returns None if the caching API is unavailable."""
+    global _PROMPT_CACHE, _PROMPT_CACHE_EXPIRY
+    with _PROMPT_CACHE_LOCK:
+        # A still-valid expiry covers both outcomes: a live cache handle, or
+        # a memoized failure (handle None) that shouldn't be retried yet
+        if time.time() < _PROMPT_CACHE_EXPIRY:
+            return _PROMPT_CACHE
+        try:
+            _PROMPT_CACHE = client.caches.create(
+                model=MODEL_NAME,
+                config={
+                    "contents": [RUBRIC_TEXT],
+                    "ttl": f"{_PROMPT_CACHE_TTL_SECONDS}s"
+                }
+            )
+            # Refresh a minute early so we never send a stale cache name
+            _PROMPT_CACHE_EXPIRY = time.time() + _PROMPT_CACHE_TTL_SECONDS - 60
+        except Exception as e:
+            print(f"Prompt cache unavailable, sending rubric inline: {e}")
+            # Failures are typically permanent (e.g. the rubric is below the
+            # minimum cached-token count), so remember them for a full TTL
+            # instead of paying a doomed create round-trip on every call
+            _PROMPT_CACHE = None
+            _PROMPT_CACHE_EXPIRY = time.time() + _PROMPT_CACHE_TTL_SECONDS
+        return _PROMPT_CACHE
+
+# Files uploaded to Gemini, keyed by sha256 of the image bytes so the same
+# frame is only uploaded once per session. Gemini keeps uploads for 48h, so
+# entries older than that are evicted and re-uploaded on next use.
+_FILE_CACHE: Dict[str, Tuple[float, object]] = {}
+_FILE_CACHE_LOCK = threading.Lock()
+_FILE_TTL_SECONDS = 48 * 3600
+
+# Worker pool so a batch of frames uploads concurrently instead of one
+# HTTPS round-trip at a time
+_UPLOAD_EXEC = ThreadPoolExecutor(max_workers=4)
+
+class AttentionCache:
+    """Nearest-neighbour cache of (batch embedding -> analysis text).
+
+    The embedding is a mean-centred, L2-normalised 32x32 grayscale
+    thumbnail per image, averaged over the batch - a cheap local feature
+    vector that tolerates compression noise better than an exact hash.
+    When a new batch lands within cosine similarity of a previous one,
+    the stored Gemini response is reused instead of a fresh API call."""
+
+    EMB_DIM = 32 * 32
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 256):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.embs = np.empty((0, self.EMB_DIM), dtype=np.float32)
+        self.values: List[str] = []
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def embed(image: PIL.Image.Image) -> np.ndarray:
+        thumb = image.convert("L").resize((32, 32), PIL.Image.BILINEAR)
+        vec = np.asarray(thumb, dtype=np.float32).ravel()
+        vec -= vec.mean()
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def embed_batch(self, images: List[PIL.Image.Image]) -> np.ndarray:
+        vec = np.mean([self.embed(img) for img in images], axis=0)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def lookup(self, emb: np.ndarray) -> Optional[str]:
+        with self.lock:
+            if not len(self.values):
+                return None
+            sims = self.embs @ emb
+            best = int(np.argmax(sims))
+            if sims[best] > self.threshold:
+                return self.values[best]
+        return None
+
+    def store(self, emb: np.ndarray, value: str):
+        with self.lock:
+            self.embs = np.vstack([self.embs, emb[None, :]])
+            self.values.append(value)
+            if len(self.values) > self.max_entries:
+                self.embs = self.embs[1:]
+                self.values.pop(0)
+
+_ANALYSIS_CACHE = AttentionCache()
+
+def _as_pil(image: Union[str, bytes, PIL.Image.Image]) -> PIL.Image.Image:
+    if isinstance(image, str):
+        return PIL.Image.open(image)
+    if isinstance(image, bytes):
+        return PIL.Image.open(io.BytesIO(image))
+    return image
+
+# Frames larger than this are shrunk before upload; the attention rubric
+# doesn't need more detail and bigger images just cost bytes and tokens
+_MAX_IMAGE_SIZE = 512
+
+def _image_bytes(image: Union[str, bytes, PIL.Image.Image]) -> bytes:
+    """Get the raw JPEG bytes for an image path, raw bytes or PIL Image."""
+    if isinstance(image, bytes):
+        # Caller already holds encoded JPEG - upload as-is, no decode/re-encode
+        return image
+    if isinstance(image, str):
+        return pathlib.Path(image).read_bytes()
+    if max(image.size) > _MAX_IMAGE_SIZE:
+        image = image.copy()
+        image.thumbnail((_MAX_IMAGE_SIZE, _MAX_IMAGE_SIZE), PIL.Image.LANCZOS)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+def _upload_image(client: genai.Client, image: Union[str, bytes, PIL.Image.Image]):
+    """Upload an image via the Files API, reusing a prior upload if we've seen
+    the same bytes before. Returns the uploaded File to reference in contents."""
+    data = _image_bytes(image)
+    digest = hashlib.sha256(data).hexdigest()
+    now = time.time()
+    with _FILE_CACHE_LOCK:
+        cached = _FILE_CACHE.get(digest)
+        if cached and now - cached[0] < _FILE_TTL_SECONDS:
+            return cached[1]
+        # Drop anything past Gemini's retention window while we're here
+        for key in [k for k, (ts, _) in _FILE_CACHE.items() if now - ts >= _FILE_TTL_SECONDS]:
+            del _FILE_CACHE[key]
+    uploaded = client.files.upload(
+        file=io.BytesIO(data),
+        config={"mime_type": "image/jpeg"}
     )
-    
-    return response.text
+    with _FILE_CACHE_LOCK:
+        _FILE_CACHE[digest] = (now, uploaded)
+    return uploaded
+
+def _stream_chunks(client: genai.Client, contents, config=None) -> Iterator[str]:
+    """Yield response text chunk by chunk as Gemini generates it"""
+    for chunk in client.models.generate_content_stream(
+        model=MODEL_NAME,
+        contents=contents,
+        config=config
+    ):
+        if chunk.text:
+            yield chunk.text
+
+def analyze_student_attention(images: List[Union[str, bytes, PIL.Image.Image]], api_key: str, custom_prompt: str = None,
+                              stream: bool = False,
+                              client: Optional[genai.Client] = None) -> Union[str, Iterator[str]]:
+    """
+    Analyzes multiple student webcam images to assess attention levels.
+
+    Args:
+        images: List of image paths (str), encoded JPEG bytes or PIL Images
+        api_key: Gemini API key
+        custom_prompt: Optional custom prompt for final analysis
+        stream: If True, return an iterator of text chunks as they arrive
+                instead of blocking until the full response is generated
+        client: Optional pre-built genai.Client; falls back to the cached
+                per-key client when omitted
+
+    Returns:
+        str: Analysis response from Gemini in a structured format
+        (or an iterator of chunks when stream=True)
+    """
+    if client is None:
+        client = get_client(api_key)
+
+    # If custom prompt is provided, use it for final analysis
+    if custom_prompt:
+        chunks = _stream_chunks(client, [custom_prompt])
+        return chunks if stream else "".join(chunks)
+
+    # Near-duplicate batches are answered from the local similarity cache
+    # without touching the API (streaming callers always go upstream since
+    # the cache holds complete responses)
+    batch_emb = None
+    if images and not stream:
+        pils = [_as_pil(img) for img in images]
+        batch_emb = _ANALYSIS_CACHE.embed_batch(pils)
+        # Embedding is the only thing that needs pixels here; images we
+        # opened ourselves (paths/bytes) are closed again right away
+        for original, pil in zip(images, pils):
+            if pil is not original:
+                pil.close()
+        cached = _ANALYSIS_CACHE.lookup(batch_emb)
+        if cached is not None:
+            return cached
+
+    # Upload each image once and reference it by URI instead of re-sending
+    # raw bytes inline on every request; uploads run in parallel but map()
+    # keeps the frames in capture order
+    processed_images = list(_UPLOAD_EXEC.map(
+        lambda img: _upload_image(client, img), images
+    ))
+
+    # Reference the rubric through the explicit prompt cache when available;
+    # otherwise fall back to sending it inline (always first, so Gemini's
+    # implicit prefix caching can still kick in)
+    prompt_cache = _get_prompt_cache(client)
+    if prompt_cache is not None:
+        chunks = _stream_chunks(
+            client,
+            processed_images,
+            config={"cached_content": prompt_cache.name}
+        )
+    else:
+        chunks = _stream_chunks(client, [RUBRIC_TEXT, *processed_images])
+
+    if stream:
+        return chunks
+    text = "".join(chunks)
+    if batch_emb is not None:
+        _ANALYSIS_CACHE.store(batch_emb, text)
+    return text
 
 
 
@@ -2,17 +2,72 @@ import gradio as gr
 import cv2
 import time
 from datetime import datetime
-import os
-import requests
+import httpx
 import threading
-import random
 
 # FastAPI server configuration
 SERVER_URL = "http://localhost:8000"
 
-# Create directory for saving images if it doesn't exist
-if not os.path.exists('webcam_captures'):
-    os.makedirs('webcam_captures')
+# One HTTP/2 client shared by the status stream, capture uploads and the
+# analysis calls - everything multiplexes over a single TLS/TCP connection
+SESSION = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+    timeout=httpx.Timeout(30.0, connect=3.0)
+)
+REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=3.0)
+STREAM_TIMEOUT = httpx.Timeout(None, connect=3.0)
+
+# JPEG quality for encoded captures
+JPEG_QUALITY = 75
+
+try:
+    # libjpeg-turbo's SIMD (AVX2/NEON) encoder is 2-4x faster than the
+    # scalar path some OpenCV wheels ship; optional, falls back to cv2
+    from turbojpeg import TurboJPEG
+    _TURBO = TurboJPEG()
+except Exception:
+    _TURBO = None
+
+def encode_jpeg(frame) -> bytes:
+    """JPEG-encode a BGR frame, via libjpeg-turbo when available"""
+    if _TURBO is not None:
+        return _TURBO.encode(frame, quality=JPEG_QUALITY, jpeg_subsample=2)
+    ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise RuntimeError("JPEG encode failed")
+    return encoded.tobytes()
+
+# Attention analysis doesn't benefit from more than ~512px, so downscale
+# before encoding - fewer bytes to upload and fewer tokens for Gemini
+MAX_FRAME_WIDTH = 512
+
+# Frames within this Hamming distance of the previously kept frame are
+# considered duplicates and skipped
+DHASH_MIN_DISTANCE = 4
+
+def configure_camera(capture):
+    """Request MJPG at a low frame rate instead of the driver default.
+
+    V4L2 defaults tend to be raw YUYV at 30fps, which burns CPU converting
+    frames we mostly discard - we only keep one per second. MJPG is
+    compressed by the camera itself, 640x480 is plenty ahead of the 512px
+    downscale, and buffersize 1 means reads always see the freshest frame."""
+    capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    capture.set(cv2.CAP_PROP_FPS, 2)
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+
+def dhash(frame) -> int:
+    """64-bit difference hash of a BGR frame (8x8 grayscale gradient)"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    diff = resized[:, 1:] > resized[:, :-1]
+    value = 0
+    for bit in diff.flatten():
+        value = (value << 1) | int(bit)
+    return value
 
 class AttentionMonitor:
     def __init__(self):
@@ -21,15 +76,22 @@ class AttentionMonitor:
         self.is_capturing = False
         self.capture_thread = None
         self.current_batch_images = []
-        
-        # Start background status update thread
-        self.status_thread = threading.Thread(target=self.fetch_status_periodically, daemon=True)
-        self.status_thread.start()
-        
+        self.status_thread = None
+
+    def start_status_listener(self):
+        """Start the single background thread that feeds current_status.
+
+        All other periodic work (the UI refresh) rides on Gradio's own
+        timer, so this is the only thread the monitor owns. Idempotent so
+        re-running create_ui can't stack up listeners."""
+        if self.status_thread is None or not self.status_thread.is_alive():
+            self.status_thread = threading.Thread(target=self.listen_status_stream, daemon=True)
+            self.status_thread.start()
+
     def create_job(self):
         """Create a job on the server"""
         try:
-            response = requests.post(f"{SERVER_URL}/create_job", json={"job_id": self.job_id})
+            response = SESSION.post(f"{SERVER_URL}/create_job", json={"job_id": self.job_id}, timeout=REQUEST_TIMEOUT)
             if response.status_code == 200:
                 print("Job created successfully.")
                 self.current_status = "Job started"
@@ -38,49 +100,81 @@ class AttentionMonitor:
         except Exception as e:
             print(f"Error creating job: {str(e)}")
 
-    def fetch_status_periodically(self):
-        """Fetch job status every 5 seconds and update UI"""
+    def listen_status_stream(self):
+        """Consume the server-sent events status stream so updates arrive as
+        soon as an analysis lands, instead of polling every 5 seconds"""
         while True:
-            time.sleep(5)
             try:
-                response = requests.post(f"{SERVER_URL}/job_status", json={"job_id": self.job_id})
-                if response.status_code == 200:
-                    self.current_status = response.json()["status"]
+                with SESSION.stream(
+                    "GET",
+                    f"{SERVER_URL}/job_status_stream",
+                    params={"job_id": self.job_id},
+                    timeout=STREAM_TIMEOUT  # the stream stays open indefinitely
+                ) as response:
+                    for line in response.iter_lines():
+                        if line.startswith("data:"):
+                            self.current_status = line[5:].strip()
             except Exception as e:
-                print(f"Error fetching status: {str(e)}")
+                print(f"Error on status stream: {str(e)}")
+            # Stream dropped (server restart, job not created yet) - retry
+            time.sleep(5)
 
     def capture_images(self):
         """Capture images every second for 10 seconds"""
         cap = cv2.VideoCapture(0)
+        configure_camera(cap)
         captured_frames = []
+        last_hash = None
         for _ in range(10):
             ret, frame = cap.read()
             if ret:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f'webcam_captures/frame_{timestamp}.jpg'
-                cv2.imwrite(filename, frame)
-                captured_frames.append(filename)
+                # Keep only frames that actually changed since the last one
+                # we accepted - a still student produces near-identical shots
+                frame_hash = dhash(frame)
+                if last_hash is not None and bin(frame_hash ^ last_hash).count("1") <= DHASH_MIN_DISTANCE:
+                    time.sleep(1)
+                    continue
+                last_hash = frame_hash
+
+                # Downscale, then encode to JPEG in memory instead of
+                # round-tripping through disk
+                height, width = frame.shape[:2]
+                if width > MAX_FRAME_WIDTH:
+                    frame = cv2.resize(
+                        frame,
+                        (MAX_FRAME_WIDTH, int(MAX_FRAME_WIDTH * height / width)),
+                        interpolation=cv2.INTER_AREA
+                    )
+                try:
+                    captured_frames.append(encode_jpeg(frame))
+                except RuntimeError as e:
+                    print(f"Error encoding frame: {e}")
             time.sleep(1)
         cap.release()
-        
-        # Select 5-6 random frames for analysis
-        selected_images = random.sample(captured_frames, random.randint(5, 6))
-        self.analyze_images(selected_images)
 
-    def analyze_images(self, image_paths):
-        """Send selected images to the server for analysis"""
+        if captured_frames:
+            self.analyze_images(captured_frames)
+
+    def analyze_images(self, frames):
+        """Send selected frames to the server for analysis"""
         try:
-            response = requests.post(f"{SERVER_URL}/analyze_student_images", json={"job_id": self.job_id, "image_paths": image_paths})
+            response = SESSION.post(
+                f"{SERVER_URL}/analyze_student_images_upload",
+                data={"job_id": self.job_id},
+                files=[
+                    ("images", (f"frame_{i}.jpg", data, "image/jpeg"))
+                    for i, data in enumerate(frames)
+                ],
+                timeout=REQUEST_TIMEOUT
+            )
             print(response.json())
-            for path in image_paths:
-                os.remove(path)
         except Exception as e:
             print(f"Error during analysis request: {e}")
 
     def get_session_summary(self):
         """Get the final analysis summary from the server"""
         try:
-            response = requests.post(f"{SERVER_URL}/analyze_job", json={"job_id": self.job_id})
+            response = SESSION.post(f"{SERVER_URL}/analyze_job", json={"job_id": self.job_id}, timeout=REQUEST_TIMEOUT)
             if response.status_code == 200:
                 return response.json()
             else:
@@ -91,6 +185,7 @@ class AttentionMonitor:
 def create_ui():
     monitor = AttentionMonitor()
     monitor.create_job()
+    monitor.start_status_listener()
     
     with gr.Blocks() as app:
         gr.Markdown("# Student Attention Monitor")
@@ -109,22 +204,23 @@ def create_ui():
             return "Capturing images..."
         
         def analyze_session():
-            return monitor.get_session_summary()
+            # Generator so the Textbox shows progress instead of sitting
+            # blank until the summary arrives
+            yield "Analyzing session..."
+            yield monitor.get_session_summary()
         
         def update_status():
-            return gr.update(value=monitor.current_status)  # Dynamically update status
-        
+            return monitor.current_status
+
         capture_btn.click(start_capture)
         analyze_btn.click(analyze_session, outputs=[analysis_output])
-        
-        # **Fix: Periodic status update without `every=10`**
-        def periodic_ui_update():
-            while True:
-                time.sleep(5)
-                status_output.update(value=monitor.current_status)
 
-        threading.Thread(target=periodic_ui_update, daemon=True).start()
-    
+        # Refresh the status box from inside Gradio's event loop; the old
+        # raw thread calling status_output.update() outside an event was a
+        # no-op that still burned CPU
+        status_timer = gr.Timer(5)
+        status_timer.tick(fn=update_status, outputs=[status_output])
+
     return app
 
 if __name__ == "__main__":
@@ -1,32 +1,174 @@
+import asyncio
 import cv2
 import time
 from datetime import datetime
 import os
 from typing import List
 import random
-import threading
-import requests
+import httpx
 import json
 
+try:
+    # Optional: libuv-backed event loop, noticeably faster socket handling
+    import uvloop
+    uvloop.install()
+except ImportError:
+    pass
+
 # FastAPI server configuration
 SERVER_URL = "http://localhost:8000"
 
-# Create directory for saving images if it doesn't exist
-if not os.path.exists('webcam_captures'):
-    os.makedirs('webcam_captures')
+# Set ATTENTION_DIRECT=1 to call gemini_analysis in-process instead of going
+# through the FastAPI server - for single-host runs the loopback HTTP hop is
+# pure JSON/TCP overhead
+USE_DIRECT = os.environ.get("ATTENTION_DIRECT") == "1"
+DIRECT_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+
+# Analyses collected while running in direct mode, so the session summary
+# can be produced without the server's job store
+direct_analyses: List[str] = []
+
+# Timeout for regular server calls; status streams stay open indefinitely
+REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=3.0)
+STREAM_TIMEOUT = httpx.Timeout(None, connect=3.0)
+
+# At most this many batches in flight at once. When the analyzer can't keep
+# up, acquiring blocks the capture loop - natural backpressure instead of an
+# unbounded pile of queued uploads
+MAX_INFLIGHT_BATCHES = 4
+
+# JPEG quality for encoded captures
+JPEG_QUALITY = 75
+
+try:
+    # libjpeg-turbo's SIMD (AVX2/NEON) encoder is 2-4x faster than the
+    # scalar path some OpenCV wheels ship; optional, falls back to cv2
+    from turbojpeg import TurboJPEG
+    _TURBO = TurboJPEG()
+except Exception:
+    _TURBO = None
+
+# Attention analysis doesn't benefit from more than ~512px, so downscale
+# before encoding - fewer bytes to upload and fewer tokens for Gemini
+MAX_FRAME_WIDTH = 512
+
+# Batch flush thresholds: send one larger multipart upload instead of many
+# small requests, but never sit on frames for more than BATCH_MAX_AGE seconds
+BATCH_MAX_FRAMES = 20
+BATCH_MAX_AGE = 30  # seconds
+
+def configure_camera(capture):
+    """Request MJPG at a low frame rate instead of the driver default.
+
+    V4L2 defaults tend to be raw YUYV at 30fps, which burns CPU converting
+    frames we mostly discard - we only keep one every few seconds. MJPG is
+    compressed by the camera itself, 640x480 is plenty ahead of the 512px
+    downscale, and buffersize 1 means reads always see the freshest frame."""
+    capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*'MJPG'))
+    capture.set(cv2.CAP_PROP_FPS, 2)
+    capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+    capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
 
 # Initialize the webcam
 cap = cv2.VideoCapture(1)  # Changed to 0 for default webcam
+configure_camera(cap)
+
+class FrameRing:
+    """Pre-allocated ring buffer of encoded JPEG frames awaiting upload.
+
+    Frames stay in RAM from capture to upload, so there is no write-to-disk,
+    read-back and delete round-trip on the hot capture path."""
+
+    def __init__(self, size: int = 16):
+        self.buf = [None] * size
+        self.size = size
+        self.idx = 0    # next write position (monotonic)
+        self.taken = 0  # first frame not yet drained
+
+    def push(self, frame_bytes: bytes):
+        self.buf[self.idx % self.size] = frame_bytes
+        self.idx += 1
+
+    def pending(self) -> int:
+        return self.idx - self.taken
+
+    def drain(self) -> List[bytes]:
+        """Return all frames pushed since the last drain"""
+        frames = [self.buf[i % self.size] for i in range(self.taken, self.idx)]
+        self.taken = self.idx
+        return frames
+
+# Frames within this Hamming distance of the last accepted frame are
+# considered duplicates and skipped
+DHASH_MIN_DISTANCE = 4
 
-def analyze_images(job_id: str, image_paths: List[str]):
-    """Send images to server for analysis"""
+def dhash(frame) -> int:
+    """64-bit difference hash of a BGR frame (8x8 grayscale gradient)"""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    resized = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    diff = resized[:, 1:] > resized[:, :-1]
+    value = 0
+    for bit in diff.flatten():
+        value = (value << 1) | int(bit)
+    return value
+
+def frames_differ(hash_a, hash_b) -> bool:
+    """True if two frame hashes are far enough apart to both be worth sending"""
+    if hash_a is None or hash_b is None:
+        return True
+    return bin(hash_a ^ hash_b).count("1") > DHASH_MIN_DISTANCE
+
+def encode_jpeg(frame) -> bytes:
+    """JPEG-encode a BGR frame, via libjpeg-turbo when available"""
+    if _TURBO is not None:
+        return _TURBO.encode(frame, quality=JPEG_QUALITY, jpeg_subsample=2)
+    ok, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+    if not ok:
+        raise RuntimeError("JPEG encode failed")
+    return encoded.tobytes()
+
+def encode_frame(frame) -> bytes:
+    """Downscale a BGR frame to MAX_FRAME_WIDTH and encode to JPEG bytes"""
+    height, width = frame.shape[:2]
+    if width > MAX_FRAME_WIDTH:
+        frame = cv2.resize(
+            frame,
+            (MAX_FRAME_WIDTH, int(MAX_FRAME_WIDTH * height / width)),
+            interpolation=cv2.INTER_AREA
+        )
+    return encode_jpeg(frame)
+
+def analyze_images_direct(frames: List[bytes]):
+    """Analyze frames in-process, skipping the HTTP hop entirely"""
+    from gemini_analysis import analyze_student_attention
+    try:
+        # analyze_student_attention takes the encoded JPEG bytes as-is;
+        # decoding them here would just allocate pixel buffers for nothing
+        analysis = analyze_student_attention(frames, DIRECT_API_KEY)
+        direct_analyses.append(analysis)
+        print("\nDirect Analysis Result:")
+        print("="*50)
+        print(analysis)
+        print("="*50)
+    except Exception as e:
+        print(f"Error during direct analysis: {e}")
+
+async def analyze_images(session: httpx.AsyncClient, job_id: str, frames: List[bytes]):
+    """Send encoded frames to server for analysis"""
+    if USE_DIRECT:
+        # The Gemini call is synchronous - keep it off the event loop
+        await asyncio.to_thread(analyze_images_direct, frames)
+        return
     try:
-        response = requests.post(
-            f"{SERVER_URL}/analyze_student_images",
-            json={
-                "job_id": job_id,
-                "image_paths": image_paths
-            }
+        response = await session.post(
+            f"{SERVER_URL}/analyze_student_images_upload",
+            data={"job_id": job_id},
+            files=[
+                ("images", (f"frame_{i}.jpg", data, "image/jpeg"))
+                for i, data in enumerate(frames)
+            ],
+            timeout=REQUEST_TIMEOUT
         )
         if response.status_code == 200:
             result = response.json()
@@ -39,41 +181,61 @@ def analyze_images(job_id: str, image_paths: List[str]):
     except Exception as e:
         print(f"Error during analysis request: {e}")
 
-def delete_images(image_paths: List[str]):
-    """Delete processed images"""
-    for path in image_paths:
-        try:
-            os.remove(path)
-            print(f"Deleted: {path}")
-        except Exception as e:
-            print(f"Error deleting {path}: {e}")
-
-def process_attention(job_id: str, images_to_process: List[str]):
-    """Process a batch of images"""
+async def process_attention(session: httpx.AsyncClient, job_id: str, frames: List[bytes]):
+    """Process a batch of frames"""
     try:
-        # Send all images for analysis
-        analyze_images(job_id, images_to_process)
-        
-        # Delete all images from the batch
-        delete_images(images_to_process)
-        
+        await analyze_images(session, job_id, frames)
     except Exception as e:
         print(f"Error during processing: {str(e)}")
 
-def get_session_summary(job_id: str):
+def get_session_summary_direct():
+    """Summarize a direct-mode session from the locally collected analyses"""
+    from gemini_analysis import analyze_student_attention
+    if not direct_analyses:
+        print("\nNo analyses recorded for this session")
+        return
+    summary_prompt = f"""
+    Analyze the following attention reports from one monitoring session and
+    provide a comprehensive summary:
+
+    Individual Analyses:
+    {chr(10).join(direct_analyses)}
+
+    Please provide a structured analysis with the following sections:
+    1. OVERALL_SUMMARY: A brief overview of the student's performance
+    2. NEGATIVE_OBSERVATIONS: List key negative behaviors and patterns
+    3. AREAS_FOR_IMPROVEMENT: List specific areas needing attention
+    4. RECOMMENDATIONS: Practical suggestions for improvement
+    5. ENGAGEMENT_PATTERN: Analysis of attention patterns over time
+    """
+    try:
+        summary = analyze_student_attention([], DIRECT_API_KEY, custom_prompt=summary_prompt)
+        print("\n" + "="*50)
+        print("SESSION SUMMARY")
+        print("="*50)
+        print(summary)
+        print("="*50)
+    except Exception as e:
+        print(f"\nError getting final analysis: {str(e)}")
+
+async def get_session_summary(session: httpx.AsyncClient, job_id: str):
     """Get the final analysis summary from the server"""
+    if USE_DIRECT:
+        await asyncio.to_thread(get_session_summary_direct)
+        return
     try:
-        response = requests.post(
+        response = await session.post(
             f"{SERVER_URL}/analyze_job",
-            json={"job_id": job_id}
+            json={"job_id": job_id},
+            timeout=REQUEST_TIMEOUT
         )
         if response.status_code == 200:
             summary = response.json()
-            
+
             print("\n" + "="*50)
             print("SESSION SUMMARY")
             print("="*50)
-            
+
             # Display Metrics
             metrics = summary["metrics"]
             print("\nMETRICS:")
@@ -82,107 +244,141 @@ def get_session_summary(job_id: str):
             print(f"Average Eye Contact: {metrics['average_eye_contact']:.2f}/10")
             print(f"Average Posture: {metrics['average_posture']:.2f}/10")
             print(f"Total Focus Duration: {metrics['total_focus_duration']} seconds")
-            
+
             # Display Analysis
             print("\nDETAILED ANALYSIS:")
             print(summary["analysis"])
-            
+
             print("="*50)
-            
+
         else:
             print(f"\nError getting session summary: {response.text}")
     except Exception as e:
         print(f"\nError getting final analysis: {str(e)}")
 
-def get_job_status(job_id: str):
-    """Get the current status from the server"""
-    try:
-        response = requests.post(
-            f"{SERVER_URL}/job_status",
-            json={"job_id": job_id}
-        )
-        if response.status_code == 200:
-            return response.json()["status"]
-        return None
-    except Exception as e:
-        print(f"Error getting job status: {e}")
-        return None
+async def watch_job_status(session: httpx.AsyncClient, job_id: str):
+    """Consume the server-sent events status stream and print each update.
 
-def main():
-    try:
-        # Create a unique job ID using timestamp
-        job_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-        print(f"Started monitoring session with job ID: {job_id}")
-        
-        last_capture_time = time.time()
-        last_status_check = time.time()
-        capture_interval = 5  # Capture every 5 seconds
-        status_check_interval = 10  # Check status every 10 seconds
-        current_batch_images = []
-        analysis_lock = threading.Lock()
-
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                print("Failed to grab frame")
-                break
-
-            # Show the frame
-            cv2.imshow('Webcam Feed (Press q to quit)', frame)
-
-            current_time = time.time()
-            
-            # Check job status every 10 seconds
-            if current_time - last_status_check >= status_check_interval:
-                status = get_job_status(job_id)
-                if status:
-                    print("\nCurrent Student Status:")
-                    print("="*50)
-                    print(status)
-                    print("="*50)
-                last_status_check = current_time
-
-            # Capture frame every interval
-            if current_time - last_capture_time >= capture_interval:
-                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                filename = f'webcam_captures/frame_{timestamp}.jpg'
-                cv2.imwrite(filename, frame)
-                
-                with analysis_lock:
-                    current_batch_images.append(filename)
-                    if len(current_batch_images) >= 5:
-                        images_to_process = current_batch_images.copy()
-                        current_batch_images = []
-                        threading.Thread(
-                            target=process_attention,
-                            args=(job_id, images_to_process),
-                            daemon=True
-                        ).start()
-                
-                last_capture_time = current_time
-
-            # Break loop on 'q' press
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
-
-        # Process any remaining images
-        with analysis_lock:
-            if current_batch_images:
-                process_attention(job_id, current_batch_images)
-
-        # Wait a bit for processing to complete
-        print("\nWaiting for final processing...")
-        time.sleep(5)
-
-        # Get and display the final session summary
-        get_session_summary(job_id)
+    Runs as a background task; updates arrive as soon as an analysis lands
+    instead of on a 10-second polling cadence."""
+    while True:
+        try:
+            async with session.stream(
+                "GET",
+                f"{SERVER_URL}/job_status_stream",
+                params={"job_id": job_id},
+                timeout=STREAM_TIMEOUT
+            ) as response:
+                async for line in response.aiter_lines():
+                    if line.startswith("data:"):
+                        status = line[5:].strip()
+                        print("\nCurrent Student Status:")
+                        print("="*50)
+                        print(status)
+                        print("="*50)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Error on status stream: {e}")
+        # Stream dropped (server restart, job not created yet) - retry
+        await asyncio.sleep(5)
 
-    except Exception as e:
-        print(f"Error in main loop: {e}")
-    finally:
-        # Cleanup
-        cap.release()
-        cv2.destroyAllWindows()
+async def main():
+    inflight = asyncio.Semaphore(MAX_INFLIGHT_BATCHES)
+    pending_batches = set()
+    status_task = None
+
+    async def submit_batch(session, job_id, frames):
+        """Start a batch upload task, bounded by the in-flight cap"""
+        await inflight.acquire()
+
+        async def _run():
+            try:
+                await process_attention(session, job_id, frames)
+            finally:
+                inflight.release()
+
+        task = asyncio.create_task(_run())
+        pending_batches.add(task)
+        task.add_done_callback(pending_batches.discard)
+
+    # One HTTP/2 client for every server call: uploads, the status stream
+    # and the summary request all multiplex over a single TLS/TCP connection
+    async with httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=16, max_keepalive_connections=16),
+        timeout=REQUEST_TIMEOUT
+    ) as session:
+        try:
+            # Create a unique job ID using timestamp
+            job_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            print(f"Started monitoring session with job ID: {job_id}")
+
+            last_capture_time = time.time()
+            capture_interval = 5  # Capture every 5 seconds
+            ring = FrameRing(size=2 * BATCH_MAX_FRAMES)
+            batch_start = time.time()
+            last_frame_hash = None
+
+            # Status updates are pushed over SSE instead of polled (the
+            # server isn't involved at all in direct mode)
+            if not USE_DIRECT:
+                status_task = asyncio.create_task(watch_job_status(session, job_id))
+
+            while True:
+                # The blocking V4L2 read happens off-loop so uploads and the
+                # status stream keep making progress between frames
+                ret, frame = await asyncio.to_thread(cap.read)
+                if not ret:
+                    print("Failed to grab frame")
+                    break
+
+                # Show the frame (UI calls must stay on the main thread)
+                cv2.imshow('Webcam Feed (Press q to quit)', frame)
+
+                current_time = time.time()
+
+                # Capture frame every interval, skipping frames that look the
+                # same as the last one we kept (student sitting still)
+                if current_time - last_capture_time >= capture_interval:
+                    frame_hash = dhash(frame)
+                    if frames_differ(frame_hash, last_frame_hash):
+                        last_frame_hash = frame_hash
+                        # No lock: the capture loop is the ring's only mutator -
+                        # upload tasks just receive the already-drained batch list
+                        ring.push(encode_frame(frame))
+                        if ring.pending() >= BATCH_MAX_FRAMES or current_time - batch_start >= BATCH_MAX_AGE:
+                            frames_to_process = ring.drain()
+                            batch_start = current_time
+                            await submit_batch(session, job_id, frames_to_process)
+
+                    last_capture_time = current_time
+
+                # Break loop on 'q' press
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+
+            # Process any remaining frames
+            if ring.pending():
+                await process_attention(session, job_id, ring.drain())
+
+            # Wait for in-flight uploads to land before asking for the summary
+            print("\nWaiting for final processing...")
+            if pending_batches:
+                await asyncio.gather(*pending_batches, return_exceptions=True)
+            await asyncio.sleep(5)
+
+            # Get and display the final session summary
+            await get_session_summary(session, job_id)
+
+        except Exception as e:
+            print(f"Error in main loop: {e}")
+        finally:
+            # Cleanup
+            if status_task is not None:
+                status_task.cancel()
+            cap.release()
+            cv2.destroyAllWindows()
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())